@@ -1,21 +1,185 @@
 import os
+import sys
+import re
 import json
+import asyncio
 import time
 import random
 import logging
-import wave
+import threading
+import struct
 import base64
+import hashlib
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Optional
+import httpx
 from google import genai
 from google.genai import types
+import numpy as np
 import torch
-import librosa
+from scipy.signal import resample_poly
 from transformers import Wav2Vec2ForSequenceClassification, Wav2Vec2FeatureExtractor
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def _json_line(record: Dict) -> bytes:
+    """Serializes one JSONL record, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return (json.dumps(record) + "\n").encode("utf-8")
+
+_TEMPLATE_FIELD = re.compile(r"\{(gender|style)\}")
+
+def _compile_template(template: str):
+    """Splits a description template once, so rendering is a join instead of a str.format parse."""
+    parts = _TEMPLATE_FIELD.split(template)
+    head, pieces = parts[0], tuple(zip(parts[1::2], parts[2::2]))
+
+    def render(gender: str, style: str) -> str:
+        out = [head]
+        for field, literal in pieces:
+            out.append(gender if field == "gender" else style)
+            out.append(literal)
+        return "".join(out)
+
+    return render
+
+class IoUringWavWriter:
+    """
+    Queues WAV writes and submits them to io_uring in batches, so a batch of files costs one
+    io_uring_enter call instead of a write syscall each. Linux only; needs the optional `liburing` package.
+    """
+
+    def __init__(self, entries: int = 64):
+        self.entries = entries
+        self._ring = liburing.Ring()
+        self._cqe = liburing.Cqe()
+        liburing.io_uring_queue_init(entries, self._ring)
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def write(self, filename: str, payload: bytes) -> Future:
+        """
+        Opens `filename` and queues `payload` for it. The data lands on disk at the next flush;
+        the returned future resolves then, or carries the error if this file's write failed.
+        """
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        written = Future()
+        with self._lock:
+            # The payload is kept referenced until its completion has been reaped
+            self._pending.append((fd, payload, written))
+            if len(self._pending) >= self.entries:
+                self._flush_locked()
+        return written
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            liburing.io_uring_queue_exit(self._ring)
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            for index, (fd, payload, _) in enumerate(pending):
+                sqe = liburing.io_uring_get_sqe(self._ring)
+                liburing.io_uring_prep_write(sqe, fd, payload, 0)
+                liburing.io_uring_sqe_set_data64(sqe, index)
+            liburing.io_uring_submit_and_wait(self._ring, len(pending))
+
+            # Reap every completion before acting on any of them, so no stale CQE is left for the next batch
+            results = [0] * len(pending)
+            for _ in pending:
+                liburing.io_uring_wait_cqe(self._ring, self._cqe)
+                entry = self._cqe[0]
+                try:
+                    # liburing raises OSError when reading a negative (failed) result
+                    results[entry.user_data] = entry.res
+                except OSError:
+                    results[entry.user_data] = -1
+                finally:
+                    liburing.io_uring_cqe_seen(self._ring, entry)
+
+            # Failed and short writes are rare for regular files; finish them synchronously.
+            # A file that still cannot be written fails only its own future, not the batch
+            for (fd, payload, written), result in zip(pending, results):
+                offset = max(result, 0)
+                try:
+                    while offset < len(payload):
+                        offset += os.pwrite(fd, memoryview(payload)[offset:], offset)
+                except OSError as e:
+                    written.set_exception(e)
+                else:
+                    written.set_result(None)
+        except BaseException as e:
+            for _, _, written in pending:
+                if not written.done():
+                    written.set_exception(e)
+            raise
+        finally:
+            for fd, _, _ in pending:
+                os.close(fd)
+
+class TokenBucket:
+    """
+    Paces requests to `refill_per_sec`, allowing bursts of up to `capacity`.
+    Used per API key so requests are spread out before the quota is hit, rather than retried after a 429.
+    """
+
+    def __init__(self, capacity: float, refill_per_sec: float):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_per_sec)
+        self.last_refill = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Waits until `tokens` are available, then consumes them."""
+        while True:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.refill_per_sec)
+
+    def drain(self, seconds: float):
+        """Empties the bucket so no request is let through for the next `seconds`."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.refill_per_sec
+
 class TTSSyntheticDataGenerator:
     """
     A class to generate synthetic TTS data using Google Gemini 2.5.
@@ -111,148 +275,696 @@ class TTSSyntheticDataGenerator:
         "This {style} auditory lesson is presented by a {gender} teacher."
     ]
 
-    def __init__(self, api_keys: List[str], output_dir: str = "output"):
+    # Bounds how many finished items may wait between pipeline stages
+    PIPELINE_QUEUE_SIZE = 4
+
+    # Gemini TTS returns 16-bit mono PCM at this rate
+    TTS_SAMPLE_RATE = 24000
+
+    # Idle connections kept open in the shared pool across all API keys
+    HTTP_KEEPALIVE_CONNECTIONS = 20
+
+    GENDER_MODEL_NAME = "prithivMLmods/Common-Voice-Geneder-Detection"
+
+    # Gender checks look at the first 10 s of 16 kHz audio, bounding attention cost on unusually long clips
+    GENDER_MAX_SAMPLES = 16000 * 10
+
+    def __init__(self, api_keys: List[str], output_dir: str = "output", concurrency: int = 4,
+                 requests_per_minute: float = 10.0, gender_batch_size: int = 16,
+                 compile_gender_model: bool = False, metadata_flush_every: int = 32,
+                 text_batch_size: int = 1, use_io_uring: bool = True,
+                 verify_gender: bool = False, verify_sample_rate: float = 0.05,
+                 gender_onnx_path: Optional[str] = None, cache_texts: bool = True):
         if not api_keys:
             raise ValueError("At least one API key is required.")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1.")
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive.")
+        if text_batch_size < 1:
+            raise ValueError("text_batch_size must be at least 1.")
+        if not 0.0 <= verify_sample_rate <= 1.0:
+            raise ValueError("verify_sample_rate must be between 0 and 1.")
         
         self.api_keys = api_keys
         self.current_key_index = 0
+        self.concurrency = concurrency
+        self.gender_batch_size = gender_batch_size
+        self.compile_gender_model = compile_gender_model
+        self.metadata_flush_every = metadata_flush_every
+        self.text_batch_size = text_batch_size
+        self.verify_gender = verify_gender
+        self.verify_sample_rate = verify_sample_rate
+        self.gender_onnx_path = gender_onnx_path
+        self.cache_texts = cache_texts
+        self._voice_names = tuple(self.VOICE_MAP.keys())
+        self._styles = tuple(self.STYLES)
+        # Sample IDs are a run timestamp plus a counter: unique within the run even when samples start in the
+        # same microsecond, and the microsecond-resolution timestamp keeps runs sharing an output_dir apart
+        self._run_ts = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        self._sample_counter = itertools.count()
+        self._compiled_templates = tuple(_compile_template(template) for template in self.TEMPLATES)
+        self._wav_header_template = struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF", 36, b"WAVE",
+            b"fmt ", 16, 1, 1, self.TTS_SAMPLE_RATE, self.TTS_SAMPLE_RATE * 2, 2, 16,
+            b"data", 0,
+        )
+        self._rate_limiters = {
+            index: TokenBucket(capacity=concurrency, refill_per_sec=requests_per_minute / 60)
+            for index in range(len(api_keys))
+        }
         self.output_dir = output_dir
         self.voice_dir = os.path.join(output_dir, "voices")
         self.metadata_file = os.path.join(output_dir, "metadata.jsonl")
+        self.gender_cache_file = os.path.join(output_dir, "gender_cache.jsonl")
+        self.text_cache_file = os.path.join(output_dir, "text_cache.jsonl")
         
         os.makedirs(self.voice_dir, exist_ok=True)
-        self._initialize_client()
-        self._initialize_gender_model()
+        # The gender cache is only consulted by the opt-in spot check
+        self._gender_cache = self._load_gender_cache() if verify_gender else {}
+        self._gender_cache_fp = open(self.gender_cache_file, "ab", buffering=1 << 16) if verify_gender else None
+        # Texts depend only on (topic, style), so repeats reuse them and only the TTS call varies by voice
+        self._text_cache = self._load_text_cache() if cache_texts else {}
+        self._text_cache_fp = open(self.text_cache_file, "ab", buffering=1 << 16) if cache_texts else None
+        self._meta_fp = open(self.metadata_file, "ab", buffering=1 << 20)
+        self._pending_metadata = 0
+        self._meta_lock = threading.Lock()
+        self._key_lock = threading.Lock()
+        self._gender_cache_lock = threading.Lock()
+        self._text_cache_lock = threading.Lock()
+        self._wav_writer = self._create_wav_writer() if use_io_uring else None
+        # WAV writes and gender inference run here so they never block the event loop
+        self._executor = ThreadPoolExecutor(max_workers=min(8, concurrency), thread_name_prefix="tts-worker")
+        # The sync entry points share one loop, since the clients' pooled connections are bound to the loop that opened
+        # them. It runs on its own thread, so several threads can call generate_sample() at once
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+        self._initialize_clients()
+        # VOICE_MAP is authoritative; the classifier is only an opt-in spot check
+        if self.verify_gender:
+            self._initialize_gender_model()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Flushes buffered metadata, closes the metadata and cache files and stops the worker threads."""
+        executor = getattr(self, "_executor", None)
+        if executor is not None:
+            executor.shutdown(wait=True)
+        http_client = getattr(self, "_http_client", None)
+        loop = getattr(self, "_loop", None)
+        self._loop = None
+        if http_client is not None and loop is not None:
+            # Pooled connections belong to the private loop, so they are closed there
+            self._http_client = None
+            asyncio.run_coroutine_threadsafe(http_client.aclose(), loop).result()
+        wav_writer = getattr(self, "_wav_writer", None)
+        if wav_writer is not None:
+            self._wav_writer = None
+            wav_writer.close()
+        for fp in (getattr(self, "_meta_fp", None), getattr(self, "_gender_cache_fp", None),
+                   getattr(self, "_text_cache_fp", None)):
+            if fp is not None and not fp.closed:
+                fp.close()
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop_thread.join()
+            loop.close()
+
+    async def aclose(self):
+        """
+        Async counterpart of close() for callers that drive run_async() on their own event loop:
+        closes the shared HTTP pool on that loop, where its connections live, then releases the rest.
+        """
+        http_client, self._http_client = self._http_client, None
+        if http_client is not None:
+            await http_client.aclose()
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def flush_batch(self):
+        """Writes buffered WAV files and metadata records through to disk."""
+        # Audio first, so metadata on disk never points at a file that is still queued
+        if self._wav_writer is not None:
+            self._wav_writer.flush()
+        with self._meta_lock:
+            self._meta_fp.flush()
+            self._pending_metadata = 0
+        if self._gender_cache_fp is not None:
+            with self._gender_cache_lock:
+                self._gender_cache_fp.flush()
+        if self._text_cache_fp is not None:
+            with self._text_cache_lock:
+                self._text_cache_fp.flush()
 
-    def _initialize_client(self):
-        key = self.api_keys[self.current_key_index]
-        self.client = genai.Client(api_key=key)
-        logger.info(f"Initialized Gemini client with key {self.current_key_index + 1}/{len(self.api_keys)}")
+    def _write_metadata(self, metadata: Dict) -> bool:
+        """Buffers one metadata record and returns whether a flush_batch() is due."""
+        with self._meta_lock:
+            self._meta_fp.write(_json_line(metadata))
+            self._pending_metadata += 1
+            return self._pending_metadata >= self.metadata_flush_every
+
+    def _run_sync(self, coro):
+        """Runs `coro` to completion on the generator's private event loop; safe to call from several threads."""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="tts-loop", daemon=True)
+                self._loop_thread.start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def _create_wav_writer(self) -> Optional[IoUringWavWriter]:
+        if sys.platform != "linux" or liburing is None:
+            return None
+        try:
+            writer = IoUringWavWriter()
+        except OSError as e:
+            logger.info(f"io_uring unavailable ({e}), writing WAV files synchronously")
+            return None
+        logger.info("Writing WAV files through io_uring")
+        return writer
+
+    def _initialize_clients(self):
+        """Creates one persistent client per key so requests can be spread across all quotas."""
+        # All clients share one keep-alive pool, so each call after the first skips DNS and the TLS handshake
+        self._http_client = httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=self.HTTP_KEEPALIVE_CONNECTIONS),
+            timeout=None,
+        )
+        http_options = types.HttpOptions(httpx_async_client=self._http_client)
+        self._clients = [genai.Client(api_key=key, http_options=http_options) for key in self.api_keys]
+        self._cooldown_until = [0.0] * len(self.api_keys)
+        logger.info(f"Initialized {len(self._clients)} Gemini client(s)")
 
     def _initialize_gender_model(self):
         logger.info("Loading gender classification model...")
-        model_name = "prithivMLmods/Common-Voice-Geneder-Detection"
-        self.gender_model = Wav2Vec2ForSequenceClassification.from_pretrained(model_name)
+        model_name = self.GENDER_MODEL_NAME
         self.gender_processor = Wav2Vec2FeatureExtractor.from_pretrained(model_name)
         self.gender_id2label = {0: "female", 1: "male"}
-        self.gender_model.eval()
-
-    def _rotate_key(self):
-        self.current_key_index += 1
-        if self.current_key_index >= len(self.api_keys):
-            self.current_key_index = 0
-        self._initialize_client()
-
-    def _predict_gender(self, audio_path: str) -> str:
-        speech, _ = librosa.load(audio_path, sr=16000)
-        inputs = self.gender_processor(speech, sampling_rate=16000, return_tensors="pt", padding=True)
-        with torch.no_grad():
+        self.gender_session = None
+        if self.gender_onnx_path is not None:
+            if ort is None:
+                raise ImportError("onnxruntime is required to use gender_onnx_path.")
+            self.gender_session = ort.InferenceSession(self.gender_onnx_path, providers=["CPUExecutionProvider"])
+            return
+
+        if torch.cuda.is_available():
+            self.gender_device = torch.device("cuda")
+            self.gender_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        else:
+            self.gender_device = torch.device("cpu")
+            self.gender_dtype = torch.bfloat16
+        self.gender_model = Wav2Vec2ForSequenceClassification.from_pretrained(model_name)
+        self.gender_model = self.gender_model.to(device=self.gender_device, dtype=self.gender_dtype).eval()
+        if self.compile_gender_model:
+            self.gender_model = torch.compile(self.gender_model, mode="reduce-overhead", dynamic=True)
+
+    def _next_key_index(self) -> int:
+        """Round-robins over the keys, skipping any that are cooling down after a 429."""
+        with self._key_lock:
+            now = time.monotonic()
+            for _ in range(len(self._clients)):
+                index = self.current_key_index
+                self.current_key_index = (index + 1) % len(self._clients)
+                if self._cooldown_until[index] <= now:
+                    return index
+            # Every key is cooling down; the drained bucket holds the request until the soonest one recovers
+            return min(range(len(self._clients)), key=self._cooldown_until.__getitem__)
+
+    def _cool_down(self, key_index: int, seconds: float):
+        with self._key_lock:
+            self._cooldown_until[key_index] = max(self._cooldown_until[key_index], time.monotonic() + seconds)
+        self._rate_limiters[key_index].drain(seconds)
+
+    def _load_gender_cache(self) -> Dict[str, str]:
+        """Loads predictions from earlier runs, keyed by the SHA-1 of the raw audio."""
+        cache = {}
+        if os.path.exists(self.gender_cache_file):
+            with open(self.gender_cache_file, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    # A line cut short by a crash is skipped rather than making the generator unusable
+                    try:
+                        cache.update(json.loads(line))
+                    except (ValueError, TypeError):
+                        logger.warning(f"Skipping malformed line {line_number} in {self.gender_cache_file}")
+        return cache
+
+    def _cache_gender_predictions(self, predictions: Dict[str, str]):
+        with self._gender_cache_lock:
+            self._gender_cache.update(predictions)
+            for audio_hash, label in predictions.items():
+                self._gender_cache_fp.write(_json_line({audio_hash: label}))
+
+    def _pcm_to_speech(self, pcm: bytes) -> np.ndarray:
+        """Decodes 16-bit mono PCM from the TTS response to 16 kHz float32, the input rate of the gender model."""
+        speech = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+        return resample_poly(speech, 16000, self.TTS_SAMPLE_RATE).astype(np.float32, copy=False)
+
+    def _classify_gender(self, inputs) -> List[int]:
+        """Runs the gender classifier on processor outputs and returns the predicted class ids."""
+        if self.gender_session is not None:
+            feeds = {i.name: inputs[i.name].numpy() for i in self.gender_session.get_inputs()}
+            logits = self.gender_session.run(None, feeds)[0]
+            return np.argmax(logits, axis=-1).tolist()
+
+        inputs = inputs.to(self.gender_device, dtype=self.gender_dtype)
+        with torch.inference_mode():
             logits = self.gender_model(**inputs).logits
-            pred = torch.argmax(logits, dim=-1).item()
-        return self.gender_id2label[pred]
+            return torch.argmax(logits, dim=-1).tolist()
+
+    def _gender_accepts_attention_mask(self) -> bool:
+        """Whether padded batches can be masked, i.e. both the feature extractor and the model take a mask."""
+        if not self.gender_processor.return_attention_mask:
+            return False
+        if self.gender_session is not None:
+            return any(i.name == "attention_mask" for i in self.gender_session.get_inputs())
+        return True
+
+    def _predict_gender(self, pcm: bytes, audio_hash: Optional[str] = None) -> str:
+        if audio_hash is not None and audio_hash in self._gender_cache:
+            return self._gender_cache[audio_hash]
+
+        speech = self._pcm_to_speech(pcm)
+        # A single clip has nothing to pad against
+        inputs = self.gender_processor(
+            speech, sampling_rate=16000, return_tensors="pt", truncation=True, max_length=self.GENDER_MAX_SAMPLES
+        )
+        label = self.gender_id2label[self._classify_gender(inputs)[0]]
+
+        if audio_hash is not None:
+            self._cache_gender_predictions({audio_hash: label})
+        return label
+
+    def _predict_gender_batch(self, pcms: List[bytes], audio_hashes: Optional[List[str]] = None) -> List[str]:
+        """
+        Classifies several clips in as few forward passes as give the same labels as classifying
+        each clip on its own, skipping cached ones.
+        """
+        audio_hashes = audio_hashes or [None] * len(pcms)
+        labels = [self._gender_cache.get(h) if h is not None else None for h in audio_hashes]
+        pending = [i for i, label in enumerate(labels) if label is None]
+        if not pending:
+            return labels
+
+        speech = {i: self._pcm_to_speech(pcms[i])[:self.GENDER_MAX_SAMPLES] for i in pending}
+        if self._gender_accepts_attention_mask():
+            groups = [pending]
+        else:
+            # Without an attention mask, zero padding shifts the logits, so only clips of equal length share a pass
+            by_length = {}
+            for i in pending:
+                by_length.setdefault(len(speech[i]), []).append(i)
+            groups = list(by_length.values())
+
+        preds = {}
+        for group in groups:
+            inputs = self.gender_processor(
+                [speech[i] for i in group], sampling_rate=16000, return_tensors="pt",
+                padding=True, truncation=True, max_length=self.GENDER_MAX_SAMPLES,
+            )
+            preds.update(zip(group, self._classify_gender(inputs)))
 
-    def _save_wav(self, filename: str, raw_data: bytes, rate: int = 24000):
+        new_entries = {}
+        for i in pending:
+            labels[i] = self.gender_id2label[preds[i]]
+            if audio_hashes[i] is not None:
+                new_entries[audio_hashes[i]] = labels[i]
+        if new_entries:
+            self._cache_gender_predictions(new_entries)
+        return labels
+
+    def _wav_header(self, data_size: int) -> bytes:
+        """Fills the RIFF and data chunk sizes into the precomputed 44-byte header."""
+        header = bytearray(self._wav_header_template)
+        struct.pack_into("<I", header, 4, 36 + data_size)
+        struct.pack_into("<I", header, 40, data_size)
+        return bytes(header)
+
+    def _save_wav(self, filename: str, raw_data: bytes) -> Optional[Future]:
+        """
+        Writes PCM data as a WAV file. With io_uring the write is only queued, and the returned
+        future resolves once it has reached the file.
+        """
         if isinstance(raw_data, str):
             raw_data = base64.b64decode(raw_data)
-        with wave.open(filename, "wb") as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(rate)
-            wf.writeframes(raw_data)
+        # One contiguous buffer and a single write, instead of the wave module's header/frame writes
+        payload = self._wav_header(len(raw_data)) + raw_data
+        if self._wav_writer is not None:
+            return self._wav_writer.write(filename, payload)
+        payload = memoryview(payload)
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while payload:
+                payload = payload[os.write(fd, payload):]
+        finally:
+            os.close(fd)
 
-    def generate_sample(self, topic: str, voice_name: Optional[str] = None, style: Optional[str] = None):
-        """Generates a single audio sample and its metadata."""
-        voice_name = voice_name or random.choice(list(self.VOICE_MAP.keys()))
-        style = style or random.choice(self.STYLES)
-        template = random.choice(self.TEMPLATES)
-        
-        assigned_gender = self.VOICE_MAP[voice_name]
-        
-        sample_id = f"teacher_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
-        audio_path = os.path.join(self.voice_dir, f"{sample_id}.wav")
-        
-        max_retries = 3
+    def _retry_after(self, error: Exception, attempt: int) -> float:
+        """Seconds to hold off a key after a 429, from Retry-After or Gemini's RetryInfo."""
+        response = getattr(error, "response", None)
+        retry_after = getattr(response, "headers", {}).get("retry-after")
+        if retry_after is None:
+            match = re.search(r"retryDelay['\"]?:\s*['\"]?(\d+(?:\.\d+)?)s", str(error))
+            retry_after = match.group(1) if match else None
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            return float(2 ** attempt)
+
+    def _update_rate_limit(self, bucket: "TokenBucket", response):
+        """Retunes a key's bucket from RateLimit-Remaining/RateLimit-Reset headers, if sent."""
+        http_response = getattr(response, "sdk_http_response", None)
+        headers = {k.lower(): v for k, v in ((http_response and http_response.headers) or {}).items()}
+        try:
+            remaining = float(headers["ratelimit-remaining"])
+            reset = float(headers["ratelimit-reset"])
+        except (KeyError, ValueError):
+            return
+        if remaining <= 0:
+            bucket.drain(reset)
+        elif reset > 0:
+            bucket.refill_per_sec = remaining / reset
+
+    async def _generate_content(self, max_retries: int = 3, **kwargs):
+        """Calls Gemini on the next available key once its bucket allows it, retrying failed requests."""
         for attempt in range(max_retries):
+            key_index = self._next_key_index()
+            bucket = self._rate_limiters[key_index]
+            await bucket.acquire()
             try:
-                # 1. Generate educational text
-                text_resp = self.client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=f"As a teacher feeling {style}, explain '{topic}' in 2 simple sentences for a child."
-                )
-                teacher_text = text_resp.text.strip()
+                response = await self._clients[key_index].aio.models.generate_content(**kwargs)
+            except Exception as e:
+                logger.warning(f"Attempt {attempt + 1} failed: {e}")
+                if attempt == max_retries - 1:
+                    raise
+                if "429" in str(e) or "quota" in str(e).lower():
+                    self._cool_down(key_index, self._retry_after(e, attempt))
+                else:
+                    await asyncio.sleep(2 ** attempt)
+                continue
+            self._update_rate_limit(bucket, response)
+            return response
 
-                # 2. Use Mapped Gender for Description
-                final_description = template.format(
-                    gender=assigned_gender,
-                    style=style
-                )
-                
-                # 3. Generate audio using TTS
-                audio_resp = self.client.models.generate_content(
-                    model="gemini-2.5-flash-preview-tts",
-                    contents=f"{final_description}\n\n{teacher_text}",
-                    config=types.GenerateContentConfig(
-                        response_modalities=["AUDIO"],
-                        speech_config=types.SpeechConfig(
-                            voice_config=types.VoiceConfig(
-                                prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice_name)
-                            )
-                        )
+    def _plan_sample(self, topic: str, voice_name: Optional[str] = None, style: Optional[str] = None) -> Dict:
+        """Picks the voice, style and description for one sample before any API call is made."""
+        voice_name = voice_name or random.choice(self._voice_names)
+        style = style or random.choice(self._styles)
+        render_description = random.choice(self._compiled_templates)
+        
+        assigned_gender = self.VOICE_MAP[voice_name]
+
+        return {
+            "sample_id": f"teacher_{self._run_ts}_{next(self._sample_counter):06d}",
+            "topic": topic,
+            "voice_name": voice_name,
+            "style": style,
+            "gender": assigned_gender,
+            # Use Mapped Gender for Description
+            "description": render_description(assigned_gender, style),
+        }
+
+    def _load_text_cache(self) -> Dict[tuple, str]:
+        """Loads texts generated by earlier runs, keyed by (topic, style)."""
+        cache = {}
+        if os.path.exists(self.text_cache_file):
+            with open(self.text_cache_file, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        cache[(record["topic"], record["style"])] = record["text"]
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning(f"Skipping malformed line {line_number} in {self.text_cache_file}")
+        return cache
+
+    def _apply_text_cache(self, jobs: List[Dict]) -> List[Dict]:
+        """Fills in cached texts and returns the jobs that still need one generated."""
+        with self._text_cache_lock:
+            for job in jobs:
+                text = self._text_cache.get((job["topic"], job["style"]))
+                if text is not None:
+                    job["text"] = text
+        return [job for job in jobs if "text" not in job]
+
+    def _cache_texts(self, jobs: List[Dict]):
+        if self._text_cache_fp is None:
+            return
+        with self._text_cache_lock:
+            for job in jobs:
+                key = (job["topic"], job["style"])
+                if key not in self._text_cache:
+                    self._text_cache[key] = job["text"]
+                    self._text_cache_fp.write(_json_line({"topic": job["topic"], "style": job["style"], "text": job["text"]}))
+
+    async def _texts_for(self, jobs: List[Dict]) -> List[Dict]:
+        """Gives every job its text, calling the model only for (topic, style) pairs not seen before."""
+        missing = self._apply_text_cache(jobs)
+        if missing:
+            await self._generate_texts(missing)
+            self._cache_texts(missing)
+        return jobs
+
+    def _text_prompt(self, job: Dict) -> str:
+        return f"As a teacher feeling {job['style']}, explain '{job['topic']}' in 2 simple sentences for a child."
+
+    async def _generate_texts(self, jobs: List[Dict]) -> List[Dict]:
+        """
+        Stage 1: generates the educational text for planned samples. Several jobs are
+        answered by one request returning a JSON array, so they share a single HTTP call.
+        """
+        if len(jobs) == 1:
+            text_resp = await self._generate_content(model="gemini-2.5-flash", contents=self._text_prompt(jobs[0]))
+            jobs[0]["text"] = text_resp.text.strip()
+            return jobs
+
+        requests = "\n".join(f"{n}. {self._text_prompt(job)}" for n, job in enumerate(jobs, 1))
+        text_resp = await self._generate_content(
+            model="gemini-2.5-flash",
+            contents=(
+                "Answer each numbered request below independently. Return a JSON array with "
+                f"exactly {len(jobs)} strings, one answer per request, in the same order.\n\n{requests}"
+            ),
+            config=types.GenerateContentConfig(response_mime_type="application/json", response_schema=list[str])
+        )
+        texts = text_resp.parsed if text_resp.parsed is not None else json.loads(text_resp.text)
+        if len(texts) != len(jobs):
+            raise ValueError(f"Expected {len(jobs)} texts in batched response, got {len(texts)}")
+        for job, text in zip(jobs, texts):
+            job["text"] = text.strip()
+        return jobs
+
+    async def _generate_audio(self, job: Dict) -> Dict:
+        """Stage 2: synthesizes speech for the text and starts writing its WAV in the background."""
+        audio_resp = await self._generate_content(
+            model="gemini-2.5-flash-preview-tts",
+            contents=f"{job['description']}\n\n{job['text']}",
+            config=types.GenerateContentConfig(
+                response_modalities=["AUDIO"],
+                speech_config=types.SpeechConfig(
+                    voice_config=types.VoiceConfig(
+                        prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=job["voice_name"])
                     )
                 )
+            )
+        )
 
-                audio_bytes = audio_resp.candidates[0].content.parts[0].inline_data.data
-                self._save_wav(audio_path, audio_bytes)
+        audio_bytes = audio_resp.candidates[0].content.parts[0].inline_data.data
+        if isinstance(audio_bytes, str):
+            audio_bytes = base64.b64decode(audio_bytes)
+        audio_path = os.path.join(self.voice_dir, f"{job['sample_id']}.wav")
+        saved = asyncio.get_running_loop().run_in_executor(self._executor, self._save_wav, audio_path, audio_bytes)
 
-                # 4. Predicted gender for clarity check only
-                predicted_gender = self._predict_gender(audio_path)
-                if assigned_gender != predicted_gender:
-                    logger.warning(f"Clarity: Model predicted {predicted_gender}, but using Map: {assigned_gender}")
-                else:
-                    logger.info(f"Clarity: Model agreed with Map ({assigned_gender})")
-
-                metadata = {
-                    "audio_file": f"voices/{sample_id}.wav",
-                    "text": teacher_text,
-                    "description": final_description,
-                    "voice_name": voice_name,
-                    "style": style,
-                    "topic": topic,
-                    "gender": assigned_gender
-                }
-                
-                with open(self.metadata_file, "a") as f:
-                    f.write(json.dumps(metadata) + "\n")
-                
-                return metadata
-                
-            except Exception as e:
-                logger.warning(f"Attempt {attempt + 1} failed: {e}")
-                if "429" in str(e) or "quota" in str(e).lower():
-                    self._rotate_key()
-                time.sleep(2 ** attempt)
+        metadata = {
+            "audio_file": f"voices/{job['sample_id']}.wav",
+            "text": job["text"],
+            "description": job["description"],
+            "voice_name": job["voice_name"],
+            "style": job["style"],
+            "topic": job["topic"],
+            "gender": job["gender"]
+        }
         
-        return None
+        # The PCM stays in memory so the gender check never reads the WAV back from disk,
+        # and can start while the write is still in flight
+        return {"metadata": metadata, "audio_path": audio_path, "pcm": audio_bytes, "saved": saved}
 
-    def run(self, topics: List[str], count: int = 10):
-        """Runs the generation process for a specified number of samples."""
+    async def _record_sample(self, sample: Dict):
+        """Waits for the sample's WAV to be written, then records its metadata."""
+        written = await sample["saved"]
+        if written is not None:
+            if not written.done():
+                # Submit the queued write, together with any others queued meanwhile, before recording the sample
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._wav_writer.flush)
+            # Raises the error of a failed write here, so no metadata is written for it
+            written.result()
+        metadata = sample["metadata"]
+        if self._write_metadata(metadata):
+            # Flushing waits on the WAV writer, so keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.flush_batch)
+        logger.info(f"✅ Saved | Gender: {metadata['gender']} | Style: {metadata['style']}")
+
+    def _should_verify_gender(self) -> bool:
+        return self.verify_gender and random.random() < self.verify_sample_rate
+
+    def _check_genders(self, samples: List[Dict]):
+        """Predicted gender for clarity check only; the mapped gender is always kept."""
+        pcms = [sample["pcm"] for sample in samples]
+        hashes = [hashlib.sha1(pcm).hexdigest() for pcm in pcms]
+        if len(samples) == 1:
+            predictions = [self._predict_gender(pcms[0], hashes[0])]
+        else:
+            predictions = self._predict_gender_batch(pcms, hashes)
+
+        for sample, predicted_gender in zip(samples, predictions):
+            assigned_gender = sample["metadata"]["gender"]
+            if assigned_gender != predicted_gender:
+                logger.warning(f"Clarity: Model predicted {predicted_gender}, but using Map: {assigned_gender}")
+            else:
+                logger.info(f"Clarity: Model agreed with Map ({assigned_gender})")
+
+    async def generate_sample_async(self, topic: str, voice_name: Optional[str] = None, style: Optional[str] = None):
+        """Generates a single audio sample and its metadata without blocking the event loop."""
+        check = None
+        try:
+            jobs = await self._texts_for([self._plan_sample(topic, voice_name, style)])
+            sample = await self._generate_audio(jobs[0])
+            if self._should_verify_gender():
+                check = asyncio.get_running_loop().run_in_executor(self._executor, self._check_genders, [sample])
+            await self._record_sample(sample)
+        except Exception as e:
+            logger.warning(f"Failed to generate sample for topic '{topic}': {e}")
+            sample = None
+        if check is not None:
+            try:
+                await check
+            except Exception as e:
+                logger.warning(f"Gender clarity check failed: {e}")
+        return sample["metadata"] if sample else None
+
+    def generate_sample(self, topic: str, voice_name: Optional[str] = None, style: Optional[str] = None):
+        """Generates a single audio sample and its metadata."""
+        metadata = self._run_sync(self.generate_sample_async(topic, voice_name, style))
+        self.flush_batch()
+        return metadata
+
+    async def run_async(self, topics: List[str], count: int = 10):
+        """
+        Generates `count` samples through a three-stage pipeline: text generation, TTS and
+        the sampled gender spot check each run in their own workers, connected by bounded queues,
+        so one sample's audio is synthesized while the next one's text is being written and
+        audio picked for verification is classified in batches as it arrives.
+        Await aclose() on the same loop when done, so the pooled connections are closed there.
+        """
+        loop = asyncio.get_running_loop()
+        text_queue = asyncio.Queue(maxsize=self.PIPELINE_QUEUE_SIZE)
+        audio_queue = asyncio.Queue(maxsize=self.PIPELINE_QUEUE_SIZE)
+        sample_numbers = iter(range(count))
         samples_generated = 0
-        for i in range(count):
-            topic = random.choice(topics)
-            logger.info(f"Generating sample {i+1}/{count} for topic: {topic}")
-            result = self.generate_sample(topic)
-            if result:
-                samples_generated += 1
-                logger.info(f"✅ Saved | Gender: {result['gender']} | Style: {result['style']}")
-            
-            # Rate limiting sleep
-            time.sleep(8)
-            
+
+        async def text_worker():
+            while True:
+                numbers = list(itertools.islice(sample_numbers, self.text_batch_size))
+                if not numbers:
+                    return
+                jobs = []
+                for i in numbers:
+                    topic = random.choice(topics)
+                    logger.info(f"Generating sample {i+1}/{count} for topic: {topic}")
+                    jobs.append(self._plan_sample(topic))
+                try:
+                    jobs = await self._texts_for(jobs)
+                except Exception as e:
+                    logger.warning(f"Failed to generate text for {len(jobs)} sample(s): {e}")
+                    continue
+                for job in jobs:
+                    await text_queue.put(job)
+
+        async def audio_worker():
+            nonlocal samples_generated
+            while True:
+                job = await text_queue.get()
+                try:
+                    sample = await self._generate_audio(job)
+                    if self._should_verify_gender():
+                        await audio_queue.put(sample)
+                    await self._record_sample(sample)
+                    samples_generated += 1
+                except Exception as e:
+                    logger.warning(f"Failed to generate audio for topic '{job['topic']}': {e}")
+                finally:
+                    text_queue.task_done()
+
+        async def gender_worker():
+            while True:
+                batch = [await audio_queue.get()]
+                while len(batch) < self.gender_batch_size and not audio_queue.empty():
+                    batch.append(audio_queue.get_nowait())
+                try:
+                    await loop.run_in_executor(self._executor, self._check_genders, batch)
+                except Exception as e:
+                    logger.warning(f"Gender clarity check failed: {e}")
+                finally:
+                    for _ in batch:
+                        audio_queue.task_done()
+
+        consumers = [asyncio.create_task(audio_worker()) for _ in range(self.concurrency)]
+        consumers.append(asyncio.create_task(gender_worker()))
+        try:
+            await asyncio.gather(*(text_worker() for _ in range(self.concurrency)))
+            await text_queue.join()
+            await audio_queue.join()
+        finally:
+            for task in consumers:
+                task.cancel()
+            await asyncio.gather(*consumers, return_exceptions=True)
+
+        await loop.run_in_executor(self._executor, self.flush_batch)
         logger.info(f"Successfully generated {samples_generated} samples.")
 
+    def run(self, topics: List[str], count: int = 10):
+        """Runs the generation process for a specified number of samples."""
+        self._run_sync(self.run_async(topics, count))
+
+def export_gender_onnx(output_dir: str, model_name: str = TTSSyntheticDataGenerator.GENDER_MODEL_NAME) -> str:
+    """
+    One-time export of the gender classifier to ONNX with dynamic INT8 weights, for CPU inference
+    through `gender_onnx_path`. Returns the path of the quantized model.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    int8_path = os.path.join(output_dir, "model_int8.onnx")
+
+    model = Wav2Vec2ForSequenceClassification.from_pretrained(model_name).eval()
+    torch.onnx.export(
+        model,
+        (torch.zeros(1, 16000),),
+        fp32_path,
+        input_names=["input_values"],
+        output_names=["logits"],
+        dynamic_axes={"input_values": {0: "batch", 1: "samples"}, "logits": {0: "batch"}},
+        dynamo=False,
+    )
+    # The weight-normed positional conv cannot be quantized; the transformer matmuls carry the cost
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8, op_types_to_quantize=["MatMul", "Gemm"])
+    logger.info(f"Exported INT8 gender model to {int8_path}")
+    return int8_path
+
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) < 2:
         print("Usage: python generator.py <api_key1> <api_key2> ...")
     else:
@@ -265,5 +977,5 @@ if __name__ == "__main__":
         else:
             topics = ["What makes planets round?", "How do plants eat sunlight?"]
             
-        gen = TTSSyntheticDataGenerator(keys)
-        gen.run(topics, count=5)
+        with TTSSyntheticDataGenerator(keys) as gen:
+            gen.run(topics, count=5)
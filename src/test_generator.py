@@ -1,5 +1,16 @@
+import asyncio
+import io
+import os
+import random
+import tempfile
 import unittest
-from generator import TTSSyntheticDataGenerator
+import wave
+import numpy as np
+import torch
+from concurrent.futures import Future, ThreadPoolExecutor
+from transformers import Wav2Vec2Config, Wav2Vec2FeatureExtractor, Wav2Vec2ForSequenceClassification
+import generator
+from generator import IoUringWavWriter, TTSSyntheticDataGenerator, TokenBucket, _compile_template
 
 class TestGenerator(unittest.TestCase):
     def test_initialization(self):
@@ -12,5 +23,188 @@ class TestGenerator(unittest.TestCase):
         with self.assertRaises(ValueError):
             TTSSyntheticDataGenerator([])
 
+    def test_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            TTSSyntheticDataGenerator(["test_key"], concurrency=0)
+
+    def test_token_bucket_drain(self):
+        bucket = TokenBucket(capacity=2, refill_per_sec=1.0)
+        bucket.drain(5)
+        self.assertLess(bucket.tokens, 0)
+
+    def test_compiled_templates_match_format(self):
+        for template in TTSSyntheticDataGenerator.TEMPLATES:
+            render = _compile_template(template)
+            self.assertEqual(render("female", "kind"), template.format(gender="female", style="kind"))
+
+class TestGeneratorIO(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.gen = TTSSyntheticDataGenerator(["key1", "key2", "key3"], output_dir=self.tmp.name, use_io_uring=False)
+
+    def tearDown(self):
+        self.gen.close()
+        self.tmp.cleanup()
+
+    def test_save_wav_matches_wave_module(self):
+        for num_samples in (0, 1, 1001, 24000):
+            raw = bytes(random.getrandbits(8) for _ in range(num_samples * 2))
+            path = os.path.join(self.tmp.name, f"{num_samples}.wav")
+            self.gen._save_wav(path, raw)
+
+            expected = io.BytesIO()
+            with wave.open(expected, "wb") as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(TTSSyntheticDataGenerator.TTS_SAMPLE_RATE)
+                wf.writeframes(raw)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), expected.getvalue())
+
+    def test_clients_share_http_pool(self):
+        for client in self.gen._clients:
+            self.assertIs(client._api_client._async_httpx_client, self.gen._http_client)
+
+    def test_text_cache_skips_repeated_prompts(self):
+        requested = []
+
+        async def fake_generate_texts(jobs):
+            requested.extend(jobs)
+            for job in jobs:
+                job["text"] = f"{job['topic']} / {job['style']}"
+            return jobs
+
+        self.gen._generate_texts = fake_generate_texts
+        first = self.gen._plan_sample("Gravity", style="happy")
+        self.gen._run_sync(self.gen._texts_for([first]))
+        repeat = self.gen._plan_sample("Gravity", voice_name="Puck", style="happy")
+        other = self.gen._plan_sample("Gravity", style="sad")
+        self.gen._run_sync(self.gen._texts_for([repeat, other]))
+        self.assertEqual(requested, [first, other])
+        self.assertEqual(repeat["text"], first["text"])
+
+        self.gen.flush_batch()
+        reloaded = TTSSyntheticDataGenerator(["key1"], output_dir=self.tmp.name, use_io_uring=False)
+        self.assertEqual(reloaded._text_cache[("Gravity", "happy")], "Gravity / happy")
+        reloaded.close()
+
+    def test_run_sync_from_several_threads(self):
+        async def work(i):
+            await asyncio.sleep(0.01)
+            return i
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda i: self.gen._run_sync(work(i)), range(8)))
+        self.assertEqual(results, list(range(8)))
+
+    def test_gender_cache_skips_malformed_lines(self):
+        with open(self.gen.gender_cache_file, "w", encoding="utf-8") as f:
+            f.write('{"abc": "male"}\n{"def": "fem')
+        self.assertEqual(self.gen._load_gender_cache(), {"abc": "male"})
+
+    def test_text_cache_skips_malformed_lines(self):
+        with open(self.gen.text_cache_file, "w", encoding="utf-8") as f:
+            f.write('{"topic": "Árboles", "style": "kind", "text": "¿Por qué?"}\n{"topic": "Gra')
+        self.assertEqual(self.gen._load_text_cache(), {("Árboles", "kind"): "¿Por qué?"})
+
+    def test_aclose_closes_http_pool_on_callers_loop(self):
+        gen = TTSSyntheticDataGenerator(["key1"], output_dir=self.tmp.name, use_io_uring=False)
+        http_client = gen._http_client
+        asyncio.run(gen.aclose())
+        self.assertTrue(http_client.is_closed)
+        self.assertTrue(gen._meta_fp.closed)
+
+    def test_batched_gender_labels_match_single(self):
+        # A tiny random classifier, so labels sit close to the boundary and padding effects show up
+        for return_attention_mask in (False, True):
+            for seed in range(16):
+                with self.subTest(return_attention_mask=return_attention_mask, seed=seed):
+                    torch.manual_seed(seed)
+                    config = Wav2Vec2Config(
+                        hidden_size=16, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32,
+                        conv_dim=(16, 16), conv_stride=(80, 4), conv_kernel=(80, 4), num_conv_pos_embeddings=8,
+                        num_conv_pos_embedding_groups=2, num_labels=2,
+                        feat_extract_norm="layer" if return_attention_mask else "group",
+                    )
+                    self.gen.gender_processor = Wav2Vec2FeatureExtractor(return_attention_mask=return_attention_mask)
+                    self.gen.gender_model = Wav2Vec2ForSequenceClassification(config).eval()
+                    self.gen.gender_session = None
+                    self.gen.gender_device = torch.device("cpu")
+                    self.gen.gender_dtype = torch.float32
+                    self.gen.gender_id2label = {0: "female", 1: "male"}
+
+                    rng = np.random.default_rng(seed)
+                    pcms = [(rng.standard_normal(n) * 3000).astype("<i2").tobytes() for n in (12000, 24000, 24000, 36000)]
+                    single = [self.gen._predict_gender(pcm) for pcm in pcms]
+                    self.assertEqual(self.gen._predict_gender_batch(pcms), single)
+
+    def test_round_robin_skips_cooling_keys(self):
+        self.gen._cool_down(1, 60)
+        self.assertEqual([self.gen._next_key_index() for _ in range(3)], [0, 2, 0])
+
+        self.gen._cool_down(0, 30)
+        self.gen._cool_down(2, 10)
+        self.assertEqual(self.gen._next_key_index(), 2)
+
+@unittest.skipIf(generator.liburing is None, "liburing is not installed")
+class TestIoUringWavWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.writer = IoUringWavWriter(entries=4)
+
+    def tearDown(self):
+        self.writer.close()
+        self.tmp.cleanup()
+
+    def test_writes_more_files_than_ring_entries(self):
+        payloads = {os.path.join(self.tmp.name, f"{i}.wav"): bytes([i]) * (1000 + i) for i in range(10)}
+        for path, payload in payloads.items():
+            self.writer.write(path, payload)
+        self.writer.flush()
+        for path, payload in payloads.items():
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), payload)
+
+    def test_failed_write_does_not_drop_batch(self):
+        good = os.path.join(self.tmp.name, "good.wav")
+        bad = os.path.join(self.tmp.name, "bad.wav")
+        open(bad, "wb").close()
+        good_written = self.writer.write(good, b"a" * 500)
+        # A read-only descriptor makes the queued write fail
+        bad_written = Future()
+        self.writer._pending.append((os.open(bad, os.O_RDONLY), b"b" * 10, bad_written))
+        self.writer.flush()
+        self.assertIsNone(good_written.result(timeout=0))
+        with self.assertRaises(OSError):
+            bad_written.result(timeout=0)
+
+        later = os.path.join(self.tmp.name, "later.wav")
+        self.writer.write(later, b"c" * 20)
+        self.writer.flush()
+        with open(good, "rb") as f:
+            self.assertEqual(f.read(), b"a" * 500)
+        with open(later, "rb") as f:
+            self.assertEqual(f.read(), b"c" * 20)
+
+    def test_failed_write_is_not_recorded(self):
+        gen = TTSSyntheticDataGenerator(["key1"], output_dir=self.tmp.name)
+        self.addCleanup(gen.close)
+        if gen._wav_writer is None:
+            self.skipTest("io_uring is unavailable")
+        bad = os.path.join(self.tmp.name, "bad.wav")
+        open(bad, "wb").close()
+        written = Future()
+        gen._wav_writer._pending.append((os.open(bad, os.O_RDONLY), b"b" * 10, written))
+
+        async def record():
+            saved = asyncio.get_running_loop().create_future()
+            saved.set_result(written)
+            await gen._record_sample({"metadata": {"gender": "male", "style": "kind"}, "saved": saved})
+
+        with self.assertRaises(OSError):
+            gen._run_sync(record())
+        gen.flush_batch()
+        self.assertEqual(os.path.getsize(gen.metadata_file), 0)
+
 if __name__ == "__main__":
     unittest.main()